@@ -2,15 +2,26 @@
 """
 Publish video URLs from videos_1.json to a RabbitMQ queue as tasks.
 Queue is durable; messages are persistent. Consumers should use manual ack (auto_ack=False).
+Each message carries up to URLS_PER_MESSAGE newline-separated URLs, so the broker's
+per-message persistence cost is paid once per batch rather than once per URL.
+The consumer acks a message only after all of its URLs are downloaded, so keep batches
+small enough to finish within the broker's consumer_timeout (30 min by default).
+Publisher confirms are enabled; at most CONFIRM_BATCH_SIZE messages are unconfirmed at a time.
+Duplicate URLs are dropped, and URLs already confirmed by an earlier run (recorded in
+QUEUED_DB) are skipped unless --republish is given.
 """
 
-import json
+import argparse
+import dbm
 import os
 import sys
+from typing import Callable, Optional
 
 import pika
 from dotenv import load_dotenv
 
+import fastjson
+
 load_dotenv()
 
 RABBITMQ_HOST = os.environ["RABBITMQ_HOST"]
@@ -21,11 +32,139 @@ RABBITMQ_VHOST = os.environ.get("RABBITMQ_VHOST", "/")
 RABBITMQ_QUEUE = os.environ["RABBITMQ_QUEUE"]
 
 VIDEOS_JSON = "videos_1.json"
+QUEUED_DB = "queued_urls.db"
+CONFIRM_BATCH_SIZE = 64
+URLS_PER_MESSAGE = 8  # keep in step with q_get_videos.URLS_PER_MESSAGE
+
+# Shared by every message; persistent so tasks survive a broker restart.
+PUBLISH_PROPERTIES = pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent)
+
+
+def publish_with_confirms(
+    parameters: pika.ConnectionParameters,
+    bodies: list[bytes],
+    on_confirmed: Optional[Callable[[bytes], None]] = None,
+) -> int:
+    """Publish bodies with publisher confirms; returns the number confirmed by the broker.
+
+    BlockingChannel waits for a confirm after every publish, so this runs on a
+    SelectConnection and keeps up to CONFIRM_BATCH_SIZE messages in flight.
+    Nacked messages are published again. on_confirmed is called with each body
+    the broker acks.
+    """
+    todo = list(reversed(bodies))  # pop() from the end keeps the original order
+    pending: dict[int, bytes] = {}  # delivery_tag -> body
+    state = {"next_tag": 1, "confirmed": 0, "error": None}
+
+    def on_open(conn):
+        conn.channel(on_open_callback=on_channel_open)
+
+    def on_open_error(conn, err):
+        state["error"] = err
+        conn.ioloop.stop()
+
+    def on_close(conn, reason):
+        if (pending or todo) and state["error"] is None:
+            state["error"] = reason
+        conn.ioloop.stop()
+
+    def on_channel_open(ch):
+        ch.add_on_close_callback(on_channel_closed)
+        # Durable queue: survives broker restart. Use with manual ack on consumers.
+        ch.queue_declare(
+            queue=RABBITMQ_QUEUE,
+            durable=True,
+            callback=lambda _frame: ch.confirm_delivery(
+                ack_nack_callback=lambda frame: on_confirm(ch, frame),
+                callback=lambda _frame: publish_batch(ch),
+            ),
+        )
+
+    def on_channel_closed(ch, reason):
+        if pending or todo:
+            state["error"] = reason
+        if ch.connection.is_open:
+            ch.connection.close()
+
+    def publish_batch(ch):
+        while todo and len(pending) < CONFIRM_BATCH_SIZE:
+            body = todo.pop()
+            ch.basic_publish("", RABBITMQ_QUEUE, body, PUBLISH_PROPERTIES)
+            pending[state["next_tag"]] = body
+            state["next_tag"] += 1
+        if not todo and not pending:
+            ch.close()
+
+    def on_confirm(ch, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [t for t in pending if t <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        for tag in tags:
+            body = pending.pop(tag, None)
+            if body is None:
+                continue
+            if nacked:
+                todo.append(body)
+            else:
+                state["confirmed"] += 1
+                if on_confirmed is not None:
+                    on_confirmed(body)
+        if not pending:
+            publish_batch(ch)
+
+    conn = pika.SelectConnection(
+        parameters,
+        on_open_callback=on_open,
+        on_open_error_callback=on_open_error,
+        on_close_callback=on_close,
+    )
+    conn.ioloop.start()
+
+    if state["error"] is not None:
+        raise RuntimeError(f"Publishing to '{RABBITMQ_QUEUE}' failed: {state['error']}")
+    return state["confirmed"]
+
+
+def unique_bodies(links: list, skip: Optional[Callable[[bytes], bool]] = None) -> list[bytes]:
+    """Encode non-empty string links once each, in order, leaving out those skip() rejects."""
+    seen: set[str] = set()
+    bodies = []
+    for url in links:
+        if not url or not isinstance(url, str) or url in seen:
+            continue
+        seen.add(url)
+        body = url.encode("utf-8")
+        if skip is not None and skip(body):
+            continue
+        bodies.append(body)
+    return bodies
+
+
+def pack_bodies(urls: list[bytes], size: int) -> list[bytes]:
+    """Join encoded URLs into newline-separated message bodies of up to size URLs each."""
+    return [b"\n".join(urls[i:i + size]) for i in range(0, len(urls), size)]
 
 
 def main():
-    with open(VIDEOS_JSON, "r") as f:
-        links = json.load(f)
+    parser = argparse.ArgumentParser(description=f"Publish URLs from {VIDEOS_JSON} to RabbitMQ")
+    parser.add_argument(
+        "--republish",
+        action="store_true",
+        help=f"Also publish URLs already recorded in {QUEUED_DB}",
+    )
+    parser.add_argument(
+        "--urls-per-message",
+        type=int,
+        default=URLS_PER_MESSAGE,
+        metavar="N",
+        help=f"URLs packed into each message (default: {URLS_PER_MESSAGE})",
+    )
+    args = parser.parse_args()
+
+    links = fastjson.read(VIDEOS_JSON)
 
     if not links:
         print("No links in", VIDEOS_JSON)
@@ -39,28 +178,25 @@ def main():
         credentials=credentials,
     )
 
-    conn = pika.BlockingConnection(parameters)
-    channel = conn.channel()
+    with dbm.open(QUEUED_DB, "c") as queued:
+        skip = None if args.republish else (lambda body: body in queued)
+        urls = unique_bodies(links, skip)
+        skipped = sum(1 for url in links if url and isinstance(url, str)) - len(urls)
+        if skipped:
+            print(f"Skipping {skipped} duplicate or already-queued URLs.")
 
-    # Durable queue: survives broker restart. Use with manual ack on consumers.
-    channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
+        published = 0
 
-    published = 0
-    for url in links:
-        if not url or not isinstance(url, str):
-            continue
-        channel.basic_publish(
-            exchange="",
-            routing_key=RABBITMQ_QUEUE,
-            body=url.encode("utf-8"),
-            properties=pika.BasicProperties(
-                delivery_mode=pika.DeliveryMode.Persistent,  # persist message
-            ),
-        )
-        published += 1
+        def record(body: bytes) -> None:
+            nonlocal published
+            for url in body.split(b"\n"):
+                queued[url] = b""
+                published += 1
 
-    conn.close()
-    print(f"Published {published} tasks to queue '{RABBITMQ_QUEUE}'.")
+        messages = publish_with_confirms(
+            parameters, pack_bodies(urls, max(1, args.urls_per_message)), record
+        )
+    print(f"Published {published} tasks in {messages} messages to queue '{RABBITMQ_QUEUE}'.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+"""
+JSON helpers shared by the scripts: orjson when installed, stdlib json otherwise.
+Output is UTF-8 with non-ASCII characters kept as-is (like ensure_ascii=False).
+"""
+
+import json
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause covers both.
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: str | bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Serialize obj to UTF-8 bytes; indent=True gives 2-space indentation."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def read(path: str | Path):
+    """Parse the JSON file at path."""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def write(path: str | Path, obj) -> None:
+    """Write obj to path as indented JSON."""
+    with open(path, "wb") as f:
+        f.write(dumps(obj, indent=True))
+
+
+def iter_jsonl(path: str | Path):
+    """Yield one record per line of a JSONL file.
+
+    Blank lines and lines that do not parse (e.g. a record half-written by a
+    crashed or still-running writer) are skipped.
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except JSONDecodeError:
+                continue
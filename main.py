@@ -1,5 +1,8 @@
-import json
+import argparse
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
 from pathlib import Path
 from typing import Iterable, List, Optional
 
@@ -14,8 +17,43 @@ except ImportError:
     )
     raise
 
+try:
+    from diskcache import Cache
+except ImportError:
+    print(
+        "The 'diskcache' package is required.\n"
+        "Install it with:\n\n"
+        "    pip install diskcache\n",
+        file=sys.stderr,
+    )
+    raise
+
+import fastjson
+
 CHANNELS_FILE = Path("channels.det")
 OUTPUT_JSON = Path("videos.json")
+MAX_WORKERS = 8
+CACHE_DIR = Path(".yt_cache")
+CACHE_EXPIRE_SEC = 24 * 60 * 60
+
+# Fields kept from each playlist entry; the rest of yt-dlp's info dict is not cached.
+ENTRY_FIELDS = ("id", "url", "webpage_url", "duration", "channel")
+# Trimmed entries always carry every ENTRY_FIELDS key, so itemgetter cannot raise.
+_entry_fields = itemgetter(*ENTRY_FIELDS)
+
+YDL_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "skip_download": True,
+    "ignoreerrors": True,
+    # List entries from the playlist pages only; a flat entry already has url/id/duration.
+    "extract_flat": "in_playlist",
+}
+
+_thread_local = threading.local()
+_ydl_instances: List[YoutubeDL] = []
+_ydl_instances_lock = threading.Lock()
+cache = Cache(str(CACHE_DIR))
 
 
 def normalize_channel_url(url: str) -> str:
@@ -39,63 +77,129 @@ def iter_channel_urls(path: Path) -> Iterable[str]:
             yield line
 
 
-def scrape_channel_videos(ydl: YoutubeDL, channel_url: str) -> List[dict]:
-    """Use yt-dlp to get all video links with duration and channel."""
-    print(f"Scraping channel: {channel_url}")
-
+@cache.memoize(expire=CACHE_EXPIRE_SEC, ignore={0, "ydl"})
+def fetch_channel_entries(ydl: YoutubeDL, channel_url: str) -> tuple[Optional[str], List[dict]]:
+    """Return (channel name, trimmed entries) for a channel; cached on disk per URL."""
     info = ydl.extract_info(channel_url, download=False)
-    entries = info.get("entries") or []
+    if not info:
+        # Raise rather than return so the failure is not cached.
+        raise RuntimeError("yt-dlp returned no info")
     channel_name = info.get("channel") or info.get("uploader") or info.get("title") or None
+    entries = [
+        complete_entry(ydl, {k: entry.get(k) for k in ENTRY_FIELDS})
+        for entry in info.get("entries") or []
+        if entry is not None
+    ]
+    return channel_name, entries
+
+
+def complete_entry(ydl: YoutubeDL, entry: dict) -> dict:
+    """Fetch the full video info only when the flat entry lacks a duration."""
+    if entry.get("duration") is not None:
+        return entry
+    video_url = entry.get("url") or entry.get("webpage_url")
+    if not video_url and entry.get("id"):
+        video_url = f"https://www.youtube.com/watch?v={entry['id']}"
+    if not video_url:
+        return entry
+    full = ydl.extract_info(video_url, download=False)
+    if full:
+        for k in ENTRY_FIELDS:
+            if entry.get(k) is None:
+                entry[k] = full.get(k)
+    return entry
+
+
+def evict_channel(channel_url: str) -> None:
+    """Drop the cached listing for channel_url so the next fetch hits YouTube."""
+    cache.delete(fetch_channel_entries.__cache_key__(None, channel_url))
 
-    videos: List[dict] = []
-    for entry in entries:
-        if entry is None:
-            continue
 
-        video_id = entry.get("id")
-        video_url = entry.get("url") or entry.get("webpage_url") or (
-            f"https://www.youtube.com/watch?v={video_id}" if video_id else None
-        )
-        if not video_url:
-            continue
+def scrape_channel_videos(ydl: YoutubeDL, channel_url: str) -> List[dict]:
+    """Use yt-dlp to get all video links with duration and channel."""
+    print(f"Scraping channel: {channel_url}")
 
-        duration = entry.get("duration")
-        channel = entry.get("channel") or channel_name
+    channel_name, entries = fetch_channel_entries(ydl, channel_url)
 
-        videos.append({
-            "url": video_url,
+    videos: List[dict] = [
+        {
+            "url": url or webpage_url or f"https://www.youtube.com/watch?v={video_id}",
             "duration": duration,
-            "channel": channel,
-        })
+            "channel": channel or channel_name,
+        }
+        for video_id, url, webpage_url, duration, channel in map(_entry_fields, entries)
+        if url or webpage_url or video_id
+    ]
 
     print(f"  Found {len(videos)} videos")
     return videos
 
 
+def get_thread_ydl() -> YoutubeDL:
+    """Return this worker thread's YoutubeDL (one instance is not safe to share)."""
+    ydl = getattr(_thread_local, "ydl", None)
+    if ydl is None:
+        ydl = YoutubeDL(YDL_OPTS)
+        _thread_local.ydl = ydl
+        with _ydl_instances_lock:
+            _ydl_instances.append(ydl)
+    return ydl
+
+
+def close_thread_ydls() -> None:
+    """Close every YoutubeDL created by get_thread_ydl."""
+    with _ydl_instances_lock:
+        instances = list(_ydl_instances)
+        _ydl_instances.clear()
+    for ydl in instances:
+        ydl.close()
+
+
+def scrape_channel(url: str, use_cache: bool = True) -> List[dict]:
+    """Worker task: scrape one channel with the thread's own YoutubeDL."""
+    channel_url = normalize_channel_url(url)
+    if not use_cache:
+        evict_channel(channel_url)
+    return scrape_channel_videos(get_thread_ydl(), channel_url)
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Scrape video links from YouTube channels")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Re-fetch every channel instead of using listings cached in {CACHE_DIR}/",
+    )
+    args = parser.parse_args()
+
     if not CHANNELS_FILE.exists():
         print(f"Channels file not found: {CHANNELS_FILE}", file=sys.stderr)
         sys.exit(1)
 
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "skip_download": True,
-        "ignoreerrors": True,
-        "extract_flat": False,
-    }
-
-    all_videos: List[dict] = []
-    with YoutubeDL(ydl_opts) as ydl:
-        for url in iter_channel_urls(CHANNELS_FILE):
-            try:
-                channel_videos = scrape_channel_videos(ydl, normalize_channel_url(url))
-                all_videos.extend(channel_videos)
-            except Exception as e:
-                print(f"Failed to scrape {url}: {e}", file=sys.stderr)
-
-    with OUTPUT_JSON.open("w", encoding="utf-8") as f:
-        json.dump(all_videos, f, ensure_ascii=False, indent=2)
+    channel_urls = list(iter_channel_urls(CHANNELS_FILE))
+    results: List[Optional[List[dict]]] = [None] * len(channel_urls)
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            futures = {
+                ex.submit(scrape_channel, url, not args.no_cache): i
+                for i, url in enumerate(channel_urls)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f"Failed to scrape {channel_urls[i]}: {e}", file=sys.stderr)
+    finally:
+        close_thread_ydls()
+
+    # Keep the output in channels-file order regardless of completion order.
+    all_videos: List[dict] = [
+        video for channel_videos in results if channel_videos for video in channel_videos
+    ]
+
+    fastjson.write(OUTPUT_JSON, all_videos)
 
     print(f"Wrote {len(all_videos)} videos to {OUTPUT_JSON}")
 
@@ -1,26 +1,85 @@
 #!/usr/bin/env python3
 """
 Upload .mp4 files from a folder to HIFFI server.
-Each file is named {id}.mp4. Metadata comes from downloaded_videos.json.
+Each file is named {id}.mp4. Metadata comes from a JSON array or a .jsonl file
+(one record per line, as written by q_get_videos.py).
 """
 
 import argparse
-import json
+import base64
 import os
 import re
 import shutil
+import string
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+import fastjson
 
 load_dotenv()
 
 PASSWORD = "123456"
 VIDEOS_JSON = "all.json"
+DEFAULT_WORKERS = 4
+TOKEN_CACHE = Path("~/.hiffi/tokens.json").expanduser()
+TOKEN_EXPIRY_MARGIN_SEC = 300
+UPLOAD_BLOCKSIZE = 1 << 20  # bytes per read/send when streaming a file body
+
+# ASCII names: one bytes.translate maps every byte outside [a-z0-9] to "_".
+_USERNAME_BYTES = frozenset((string.ascii_lowercase + string.digits).encode())
+_USERNAME_TABLE = bytes(b if b in _USERNAME_BYTES else ord("_") for b in range(256))
+# Non-ASCII names (rare) keep the single-pass regex.
+_NON_USERNAME_RE = re.compile(r"[^a-z0-9]+")
+
+
+class LargeBlockHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections stream request bodies in UPLOAD_BLOCKSIZE chunks.
+
+    urllib3 defaults to 16 KiB, i.e. ~64k Python-level read/sendall calls per GiB.
+    """
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("blocksize", UPLOAD_BLOCKSIZE)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+
+def make_session() -> requests.Session:
+    """Session with keep-alive connection pooling and retries on transient errors.
+
+    urllib3 only retries idempotent methods by default, so POSTs (auth, upload
+    links, ack) are not repeated; PUTs to presigned URLs are.
+    """
+    session = requests.Session()
+    adapter = LargeBlockHTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = make_session()
 
 
 def channel_to_username(channel: str) -> str:
@@ -28,21 +87,42 @@ def channel_to_username(channel: str) -> str:
     if not channel:
         return "unknown"
     s = channel.strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "_", s)
-    s = s.strip("_") or "user"
+    if s.isascii():
+        # Splitting on "_" and dropping empty parts collapses runs and strips the ends.
+        s = b"_".join(filter(None, s.encode().translate(_USERNAME_TABLE).split(b"_"))).decode()
+    else:
+        s = _NON_USERNAME_RE.sub("_", s).strip("_")
+    s = s or "user"
     return s[:64]  # reasonable limit
 
 
-def load_metadata() -> dict[str, dict]:
-    """Load downloaded_videos.json as id -> metadata mapping."""
-    with open(VIDEOS_JSON, "r") as f:
-        records = json.load(f)
-    return {r["id"]: r for r in records if r.get("id")}
+def iter_metadata_records(path: str):
+    """Yield records from a .jsonl file or a JSON array (streamed with ijson when installed)."""
+    if path.endswith(".jsonl"):
+        yield from fastjson.iter_jsonl(path)
+    elif ijson is not None:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+    else:
+        yield from fastjson.read(path)
+
+
+def load_metadata(path: str = VIDEOS_JSON, needed: set[str] | None = None) -> dict[str, dict]:
+    """Load a metadata file (.json array or .jsonl) as id -> metadata mapping.
+
+    With needed, only records whose id is in it are kept.
+    """
+    metadata = {}
+    for r in iter_metadata_records(path):
+        vid_id = r.get("id")
+        if vid_id and (needed is None or vid_id in needed):
+            metadata[vid_id] = r
+    return metadata
 
 
 def auth_login(base_url: str, username: str) -> str | None:
     """Try login. Returns token or None."""
-    r = requests.post(
+    r = SESSION.post(
         f"{base_url}/auth/login",
         json={"username": username, "password": PASSWORD},
         timeout=30,
@@ -61,7 +141,7 @@ def auth_register(base_url: str, username: str) -> str:
         "password": PASSWORD,
         "email": f"{username}@creators.hiffi.com",
     }
-    r = requests.post(f"{base_url}/auth/register-direct", json=body, timeout=30)
+    r = SESSION.post(f"{base_url}/auth/register-direct", json=body, timeout=30)
     r.raise_for_status()
     data = r.json()
     if not data.get("success") or not data.get("data", {}).get("token"):
@@ -77,11 +157,142 @@ def get_token(base_url: str, username: str) -> str:
     return auth_register(base_url, username)
 
 
+def token_expiry(token: str) -> float | None:
+    """Return the JWT exp claim (unverified), or None if the token has none."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = fastjson.loads(base64.urlsafe_b64decode(payload)).get("exp")
+    except (IndexError, ValueError, AttributeError):
+        return None
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+def load_token_cache() -> dict[str, dict[str, str]]:
+    """Load TOKEN_CACHE as base_url -> username -> token."""
+    try:
+        data = fastjson.read(TOKEN_CACHE)
+    except (OSError, fastjson.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_token_cache(cache: dict[str, dict[str, str]]) -> None:
+    """Write TOKEN_CACHE atomically (temp file + rename), readable only by the owner."""
+    TOKEN_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=TOKEN_CACHE.parent, prefix=".tokens-", suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(fastjson.dumps(cache, indent=True))
+        os.replace(tmp, TOKEN_CACHE)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+# _token_lock guards tokens_by_username, TOKEN_CACHE and _username_locks and is never
+# held across network calls; each username's lock makes its login/register single-flight.
+_token_lock = threading.Lock()
+_username_locks: dict[str, threading.Lock] = {}
+_token_cache: dict[str, dict[str, str]] | None = None
+
+
+def _cached_token(base_url: str, username: str) -> str | None:
+    """Return an unexpired token from TOKEN_CACHE. Caller holds _token_lock."""
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = load_token_cache()
+    token = _token_cache.get(base_url, {}).get(username)
+    if not token:
+        return None
+    exp = token_expiry(token)
+    if exp is not None and exp - TOKEN_EXPIRY_MARGIN_SEC <= time.time():
+        return None
+    return token
+
+
+def _store_token(base_url: str, username: str, token: str | None) -> None:
+    """Set (or with None, drop) a token in TOKEN_CACHE. Caller holds _token_lock."""
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = load_token_cache()
+    by_user = _token_cache.setdefault(base_url, {})
+    if token is None:
+        by_user.pop(username, None)
+    else:
+        by_user[username] = token
+    try:
+        save_token_cache(_token_cache)
+    except OSError as e:
+        print(f"  Warning: could not write {TOKEN_CACHE}: {e}", file=sys.stderr)
+
+
+def _username_lock(username: str) -> threading.Lock:
+    with _token_lock:
+        return _username_locks.setdefault(username, threading.Lock())
+
+
+def ensure_token(base_url: str, username: str, tokens_by_username: dict[str, str]) -> str:
+    """Return the token for username, authenticating at most once across threads.
+
+    Only threads waiting on the same username block during its login; others proceed.
+    Tokens persist in TOKEN_CACHE, so later runs skip login until the JWT expires.
+    """
+    with _token_lock:
+        token = tokens_by_username.get(username)
+    if token is not None:
+        return token
+
+    with _username_lock(username):
+        with _token_lock:
+            token = tokens_by_username.get(username) or _cached_token(base_url, username)
+            if token is not None:
+                tokens_by_username[username] = token
+                return token
+        print(f"  Auth for {username}...")
+        token = get_token(base_url, username)
+        with _token_lock:
+            _store_token(base_url, username, token)
+            tokens_by_username[username] = token
+        return token
+
+
+def refresh_token(
+    base_url: str, username: str, tokens_by_username: dict[str, str], rejected: str
+) -> str:
+    """Drop a token the server rejected (401) and authenticate again."""
+    with _token_lock:
+        # Another thread may already have replaced it.
+        if tokens_by_username.get(username) == rejected:
+            del tokens_by_username[username]
+            _store_token(base_url, username, None)
+    return ensure_token(base_url, username, tokens_by_username)
+
+
+def is_unauthorized(exc: BaseException) -> bool:
+    """True if exc is an HTTP 401 (expired or revoked token)."""
+    return (
+        isinstance(exc, requests.exceptions.HTTPError)
+        and exc.response is not None
+        and exc.response.status_code == 401
+    )
+
+
+def is_register_400(exc: BaseException) -> bool:
+    """True if exc is the 400 returned by /auth/register-direct (unusable username)."""
+    return (
+        isinstance(exc, requests.exceptions.HTTPError)
+        and exc.response is not None
+        and exc.response.status_code == 400
+        and "register-direct" in (exc.response.url or "")
+    )
+
+
 def get_upload_links(
     base_url: str, token: str, video_title: str, video_description: str
 ) -> tuple[str, str, str]:
     """Step 2: Request upload URLs. Returns (bridge_id, gateway_url, gateway_url_thumbnail)."""
-    r = requests.post(
+    r = SESSION.post(
         f"{base_url}/videos/upload",
         headers={"Authorization": f"Bearer {token}"},
         json={
@@ -103,39 +314,50 @@ def get_upload_links(
     return d["bridge_id"], d["gateway_url"], d["gateway_url_thumbnail"]
 
 
-def extract_thumbnail(video_path: str, duration_sec: float, out_path: str) -> None:
-    """Extract middle frame as thumbnail using ffmpeg."""
+def extract_thumbnail(video_path: str, duration_sec: float) -> bytes:
+    """Extract middle frame as JPEG bytes using ffmpeg (written to stdout, no temp file)."""
     mid = max(0, duration_sec / 2.0)
-    subprocess.run(
+    result = subprocess.run(
         [
             "ffmpeg",
-            "-y",
+            "-loglevel", "error",
             "-ss", str(mid),
             "-i", video_path,
-            "-vframes", "1",
+            "-map", "0:v:0",
+            "-an",
+            "-frames:v", "1",
             "-q:v", "2",
-            out_path,
+            "-f", "image2",
+            "-vcodec", "mjpeg",
+            "pipe:1",
         ],
         check=True,
         capture_output=True,
     )
+    return result.stdout
 
 
 def upload_to_presigned_url(url: str, file_path: str, content_type: str) -> None:
     """PUT file to presigned S3/R2 URL."""
+    # Explicit Content-Length so the body is never sent chunked (presigned PUTs reject it).
+    headers = {
+        "Content-Type": content_type,
+        "Content-Length": str(os.path.getsize(file_path)),
+    }
     with open(file_path, "rb") as f:
-        r = requests.put(
-            url,
-            data=f,
-            headers={"Content-Type": content_type},
-            timeout=600,
-        )
+        r = SESSION.put(url, data=f, headers=headers, timeout=600)
+    r.raise_for_status()
+
+
+def upload_bytes_to_presigned_url(url: str, data: bytes, content_type: str) -> None:
+    """PUT in-memory bytes to presigned S3/R2 URL."""
+    r = SESSION.put(url, data=data, headers={"Content-Type": content_type}, timeout=600)
     r.raise_for_status()
 
 
 def acknowledge_upload(base_url: str, token: str, bridge_id: str) -> None:
     """Step 4: Acknowledge upload complete."""
-    r = requests.post(
+    r = SESSION.post(
         f"{base_url}/videos/upload/ack/{bridge_id}",
         headers={"Authorization": f"Bearer {token}"},
         timeout=30,
@@ -155,36 +377,64 @@ def upload_video(
     """Upload a single video through the full flow."""
     channel = meta.get("channel") or "unknown"
     username = channel_to_username(channel)
+    token = ensure_token(base_url, username, tokens_by_username)
 
-    if username not in tokens_by_username:
-        print(f"  Auth for {username}...")
-        tokens_by_username[username] = get_token(base_url, username)
-
-    token = tokens_by_username[username]
-
+    vid_id = meta.get("id") or Path(video_path).stem
     title = meta.get("title") or os.path.basename(video_path)
     description = meta.get("description") or ""
     duration = float(meta.get("duration") or 0)
 
-    print(f"  Step 2: Get upload links...")
-    bridge_id, gateway_url, gateway_url_thumbnail = get_upload_links(
-        base_url, token, title, description
-    )
+    print(f"  [{vid_id}] Step 2: Get upload links...")
+    try:
+        bridge_id, gateway_url, gateway_url_thumbnail = get_upload_links(
+            base_url, token, title, description
+        )
+    except requests.exceptions.HTTPError as e:
+        if not is_unauthorized(e):
+            raise
+        token = refresh_token(base_url, username, tokens_by_username, token)
+        bridge_id, gateway_url, gateway_url_thumbnail = get_upload_links(
+            base_url, token, title, description
+        )
 
-    print(f"  Step 3: Upload video + thumbnail...")
+    print(f"  [{vid_id}] Step 3: Upload video + thumbnail...")
     upload_to_presigned_url(gateway_url, video_path, "video/mp4")
 
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tf:
-        thumb_path = tf.name
+    thumbnail = extract_thumbnail(video_path, duration)
+    upload_bytes_to_presigned_url(gateway_url_thumbnail, thumbnail, "image/jpeg")
+
+    print(f"  [{vid_id}] Step 4: Acknowledge...")
     try:
-        extract_thumbnail(video_path, duration, thumb_path)
-        upload_to_presigned_url(gateway_url_thumbnail, thumb_path, "image/jpeg")
-    finally:
-        os.unlink(thumb_path)
+        acknowledge_upload(base_url, token, bridge_id)
+    except requests.exceptions.HTTPError as e:
+        if not is_unauthorized(e):
+            raise
+        token = refresh_token(base_url, username, tokens_by_username, token)
+        acknowledge_upload(base_url, token, bridge_id)
+    print(f"  [{vid_id}] Done: {bridge_id}")
 
-    print(f"  Step 4: Acknowledge...")
-    acknowledge_upload(base_url, token, bridge_id)
-    print(f"  Done: {bridge_id}")
+
+def upload_and_move(
+    base_url: str,
+    video_path: Path,
+    meta: dict,
+    tokens_by_username: dict[str, str],
+    done_dir: Path,
+    errors_dir: Path,
+) -> bool:
+    """Worker task: upload one file and move it to done_dir. Returns False if moved to errors_dir."""
+    vid_id = meta["id"]
+    print(f"\n[{vid_id}] {meta.get('title', '')[:50]}...")
+    try:
+        upload_video(base_url, str(video_path), meta, tokens_by_username)
+    except requests.exceptions.HTTPError as e:
+        if is_register_400(e):
+            print(f"  [{vid_id}] Register-direct 400, moving to download_errors/", file=sys.stderr)
+            shutil.move(str(video_path), str(errors_dir / video_path.name))
+            return False
+        raise
+    shutil.move(str(video_path), str(done_dir / video_path.name))
+    return True
 
 
 def main() -> None:
@@ -208,6 +458,19 @@ def main() -> None:
         metavar="N",
         help="Upload only N files (for testing)",
     )
+    parser.add_argument(
+        "--metadata",
+        default=VIDEOS_JSON,
+        help=f"Metadata file, .json or .jsonl (default: {VIDEOS_JSON})",
+    )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=DEFAULT_WORKERS,
+        metavar="N",
+        help=f"Concurrent uploads (default: {DEFAULT_WORKERS})",
+    )
     args = parser.parse_args()
 
     folder = Path(args.folder)
@@ -215,13 +478,14 @@ def main() -> None:
         print(f"Error: {folder} is not a directory", file=sys.stderr)
         sys.exit(1)
 
-    metadata = load_metadata()
     mp4_files = list(folder.glob("*.mp4"))
 
     if not mp4_files:
         print(f"No .mp4 files in {folder}")
         return
 
+    metadata = load_metadata(args.metadata, {p.stem for p in mp4_files})
+
     missing = []
     to_upload = []
     for p in mp4_files:
@@ -249,28 +513,50 @@ def main() -> None:
     errors_dir = folder.parent / "download_errors"
     errors_dir.mkdir(parents=True, exist_ok=True)
 
+    by_username: dict[str, list[tuple[Path, dict]]] = {}
     for video_path, meta in to_upload:
-        vid_id = meta["id"]
-        print(f"\n[{vid_id}] {meta.get('title', '')[:50]}...")
+        username = channel_to_username(meta.get("channel") or "unknown")
+        by_username.setdefault(username, []).append((video_path, meta))
+
+    # Authenticate every channel up front, one at a time, so workers never race to register.
+    failed: list[str] = []
+    jobs: list[tuple[Path, dict]] = []
+    for username, items in by_username.items():
         try:
-            upload_video(args.base_url, str(video_path), meta, tokens_by_username)
-            shutil.move(str(video_path), str(done_dir / video_path.name))
-        except requests.exceptions.HTTPError as e:
-            if (
-                e.response is not None
-                and e.response.status_code == 400
-                and "register-direct" in (e.response.url or "")
-            ):
-                print(f"  Register-direct 400, moving to download_errors/", file=sys.stderr)
-                shutil.move(str(video_path), str(errors_dir / video_path.name))
-            else:
-                print(f"  Failed: {e}", file=sys.stderr)
-                raise
+            ensure_token(args.base_url, username, tokens_by_username)
         except Exception as e:
-            print(f"  Failed: {e}", file=sys.stderr)
-            raise
-
-    print(f"\nUploaded {len(to_upload)} videos.")
+            if is_register_400(e):
+                print(f"  Register-direct 400 for {username}, moving {len(items)} file(s) to download_errors/", file=sys.stderr)
+                for video_path, _ in items:
+                    shutil.move(str(video_path), str(errors_dir / video_path.name))
+            else:
+                print(f"  Auth failed for {username}: {e}", file=sys.stderr)
+                failed.extend(meta["id"] for _, meta in items)
+            continue
+        jobs.extend(items)
+
+    uploaded = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futures = {
+            ex.submit(
+                upload_and_move,
+                args.base_url, video_path, meta, tokens_by_username, done_dir, errors_dir,
+            ): meta["id"]
+            for video_path, meta in jobs
+        }
+        for future in as_completed(futures):
+            vid_id = futures[future]
+            exc = future.exception()
+            if exc is not None:
+                print(f"  [{vid_id}] Failed: {exc}", file=sys.stderr)
+                failed.append(vid_id)
+            elif future.result():
+                uploaded += 1
+
+    print(f"\nUploaded {uploaded} videos.")
+    if failed:
+        print(f"Failed {len(failed)} videos: {failed[:5]}{'...' if len(failed) > 5 else ''}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,34 @@
 #!/usr/bin/env python3
 """
 RabbitMQ consumer: take video URLs from the queue, download with yt_dlp, then ack.
-Processes one message at a time. Updates a JSON file with video metadata after each download.
+A message holds one or more newline-separated URLs; it is acked once all of them are
+handled and requeued if any was cut short (finished ones are then skipped as duplicates).
+Downloads up to --workers URLs concurrently; prefetch_count is sized in URLs
+(ceil(workers / --urls-per-message), i.e. 1 for packed messages) so a message is never
+held unacked long enough to hit RabbitMQ's consumer_timeout (30 min by default; raise it
+on the broker if you publish much larger batches). Download starts are spaced
+DELAY_BETWEEN_DOWNLOADS_SEC apart across all workers.
+Appends video metadata to a JSONL file after each download
+(--compact rebuilds downloaded_videos.json from it).
 YouTube timeout → exit program. Rate limit → log and exit program. Other errors → log and skip.
+With --upload, finished downloads are handed to background uploader threads (push.py flow)
+so uploads overlap with the next downloads.
 """
 
-import json
+import argparse
+import functools
+import logging
+import logging.handlers
+import math
 import os
+import queue
+import re
 import socket
 import sys
+import threading
 import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -18,18 +37,30 @@ from dotenv import load_dotenv
 
 try:
     from yt_dlp import YoutubeDL
+    from yt_dlp.networking.exceptions import HTTPError as YtHTTPError
 except ImportError:
     print("Install yt-dlp: pip install yt-dlp", file=sys.stderr)
     raise
 
+import fastjson
+import push
+
 load_dotenv()
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 DOWNLOADS_DIR = SCRIPT_DIR / "downloads"
 METADATA_JSON = SCRIPT_DIR / "downloaded_videos.json"
+METADATA_JSONL = SCRIPT_DIR / "downloaded_videos.jsonl"
 ERROR_LOG = SCRIPT_DIR / "download_errors.log"
+UPLOAD_ERROR_LOG = SCRIPT_DIR / "upload_errors.log"
+DONE_DIR = SCRIPT_DIR / "downloads_done"
+UPLOAD_ERRORS_DIR = SCRIPT_DIR / "download_errors"
+UPLOAD_QUEUE_SIZE = 4
 COOKIES_FILE = SCRIPT_DIR / "cookies.txt"
+ARCHIVE_FILE = SCRIPT_DIR / "archive.txt"
 DELAY_BETWEEN_DOWNLOADS_SEC = 5
+DEFAULT_DOWNLOAD_WORKERS = 4
+URLS_PER_MESSAGE = 8  # keep in step with a_q_put_videos.URLS_PER_MESSAGE
 
 RABBITMQ_HOST = os.environ["RABBITMQ_HOST"]
 RABBITMQ_PORT = int(os.environ.get("RABBITMQ_PORT", "5672"))
@@ -38,6 +69,36 @@ RABBITMQ_PASSWORD = os.environ["RABBITMQ_PASSWORD"]
 RABBITMQ_VHOST = os.environ.get("RABBITMQ_VHOST", "/")
 RABBITMQ_QUEUE = os.environ["RABBITMQ_QUEUE"]
 
+_VIDEO_ID_RE = re.compile(r"(?:watch\?v=|youtu\.be/|shorts/)([A-Za-z0-9_-]{6,})")
+_TIMEOUT_RE = re.compile(r"timed?[- ]?out", re.IGNORECASE)
+_RATE_LIMIT_RE = re.compile(r"\b429\b|rate[- ]?limit|too many requests", re.IGNORECASE)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available."""
+
+    def __init__(self, interval_sec: float, burst: int = 1) -> None:
+        self.interval_sec = interval_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval_sec)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval_sec
+            time.sleep(wait)
+
+
+_metadata_lock = threading.Lock()
+
 
 def ensure_downloads_dir() -> None:
     DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
@@ -47,71 +108,141 @@ def load_metadata() -> list:
     if not METADATA_JSON.exists():
         return []
     try:
-        with open(METADATA_JSON, "r", encoding="utf-8") as f:
+        with open(METADATA_JSON, "rb") as f:
             data = f.read().strip()
             if not data:
                 return []
-            return json.loads(data)
-    except (json.JSONDecodeError, OSError):
+            return fastjson.loads(data)
+    except (fastjson.JSONDecodeError, OSError):
         return []
 
 
 def save_metadata(records: list) -> None:
-    with open(METADATA_JSON, "w", encoding="utf-8") as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
+    fastjson.write(METADATA_JSON, records)
+
+
+def append_metadata(meta: dict, fsync: bool = False) -> None:
+    """Append one record to METADATA_JSONL (one JSON object per line)."""
+    line = fastjson.dumps(meta) + b"\n"
+    with _metadata_lock, open(METADATA_JSONL, "ab") as f:
+        f.write(line)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_metadata_jsonl() -> list:
+    """Read METADATA_JSONL, skipping blank or partially written lines."""
+    if not METADATA_JSONL.exists():
+        return []
+    return list(fastjson.iter_jsonl(METADATA_JSONL))
+
+
+def compact_to_json() -> int:
+    """Merge METADATA_JSONL into METADATA_JSON (latest record per id wins). Returns record count."""
+    by_id: dict = {}
+    for r in load_metadata() + load_metadata_jsonl():
+        by_id[r.get("id")] = r
+    records = list(by_id.values())
+    save_metadata(records)
+    return len(records)
 
 
 def video_id_from_url(url: str) -> str | None:
-    """Extract YouTube video ID from url (youtube.com/watch?v=ID)."""
-    if "watch?v=" in url:
-        return url.split("watch?v=", 1)[1].split("&")[0].strip()
-    if "youtu.be/" in url:
-        return url.split("youtu.be/", 1)[1].split("?")[0].strip()
-    return None
+    """Extract YouTube video ID from url (watch?v=ID, youtu.be/ID or shorts/ID)."""
+    m = _VIDEO_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+def iter_exception_chain(exc: BaseException | None):
+    """Yield exc and the exceptions it wraps: __cause__, yt-dlp's .cause and .exc_info."""
+    seen: set[int] = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc_info = getattr(exc, "exc_info", None)
+        wrapped = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+        cause = getattr(exc, "cause", None)
+        exc = next(
+            (e for e in (exc.__cause__, cause, wrapped) if isinstance(e, BaseException)),
+            None,
+        )
+
+
+def _error_message(exc: BaseException) -> str:
+    return getattr(exc, "msg", None) or str(exc)
 
 
 def is_timeout_error(exc: BaseException) -> bool:
     """True if the exception is a timeout (YouTube/timeout → exit program)."""
-    if isinstance(exc, (socket.timeout, TimeoutError)):
-        return True
-    msg = (getattr(exc, "msg", None) or str(exc)).lower()
-    if "timeout" in msg or "timed out" in msg:
-        return True
-    cause = getattr(exc, "__cause__", None)
-    if cause and is_timeout_error(cause):
-        return True
-    return False
+    chain = list(iter_exception_chain(exc))
+    for e in chain:
+        if isinstance(e, (socket.timeout, TimeoutError)):
+            return True
+        if isinstance(e, urllib.error.URLError) and isinstance(e.reason, (socket.timeout, TimeoutError)):
+            return True
+    return any(_TIMEOUT_RE.search(_error_message(e)) for e in chain)
 
 
 def is_rate_limit_error(exc: BaseException) -> bool:
     """True if the exception indicates rate limiting (→ log and exit program)."""
-    msg = (getattr(exc, "msg", None) or str(exc)).lower()
-    if "429" in msg or "rate limit" in msg or "too many requests" in msg:
-        return True
-    cause = getattr(exc, "__cause__", None)
-    if cause and is_rate_limit_error(cause):
+    chain = list(iter_exception_chain(exc))
+    if any(isinstance(e, YtHTTPError) and e.status == 429 for e in chain):
         return True
-    return False
+    return any(_RATE_LIMIT_RE.search(_error_message(e)) for e in chain)
+
+
+download_error_logger = logging.getLogger("dl_errors")
+upload_error_logger = logging.getLogger("upload_errors")
+_error_log_queue: queue.Queue = queue.Queue()
+
+
+def start_error_logging() -> logging.handlers.QueueListener:
+    """Route the error loggers through a queue to a background thread that owns the files.
+
+    Callers only enqueue a record; the listener keeps ERROR_LOG / UPLOAD_ERROR_LOG open.
+    """
+    handlers = []
+    for logger, path in ((download_error_logger, ERROR_LOG), (upload_error_logger, UPLOAD_ERROR_LOG)):
+        handler = logging.FileHandler(path, encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.addFilter(logging.Filter(logger.name))
+        handlers.append(handler)
+        logger.addHandler(logging.handlers.QueueHandler(_error_log_queue))
+        logger.setLevel(logging.ERROR)
+        logger.propagate = False
+    listener = logging.handlers.QueueListener(_error_log_queue, *handlers)
+    listener.start()
+    return listener
 
 
-def log_error(video_id: str, error: BaseException) -> None:
-    """Append a single line to the error log: simple detail + video id."""
+def stop_error_logging(listener: logging.handlers.QueueListener) -> None:
+    """Write out queued records and close the log files."""
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    for logger in (download_error_logger, upload_error_logger):
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+
+
+def log_error(video_id: str, error: BaseException, logger: logging.Logger = download_error_logger) -> None:
+    """Log a single line to the error log: simple detail + video id."""
     detail = (getattr(error, "msg", None) or str(error)).strip().replace("\n", " ")
     if len(detail) > 200:
         detail = detail[:197] + "..."
-    line = f"{datetime.now().isoformat()} video_id={video_id} {detail}\n"
-    with open(ERROR_LOG, "a", encoding="utf-8") as f:
-        f.write(line)
+    logger.error("%s video_id=%s %s", datetime.now().isoformat(), video_id, detail)
 
 
-def download_and_collect_metadata(url: str) -> dict | None:
-    """Download video to DOWNLOADS_DIR and return metadata dict for JSON."""
-    ensure_downloads_dir()
+def build_ydl_opts() -> dict:
+    """yt-dlp options for downloading into DOWNLOADS_DIR."""
     outtmpl = str(DOWNLOADS_DIR / "%(id)s.%(ext)s")
 
     ydl_opts = {
         "outtmpl": outtmpl,
         "quiet": False,
+        # Fail a stalled connection after 30 s so is_timeout_error sees it.
+        "socket_timeout": 30,
         "merge_output_format": "mp4",
         "format": "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720]+bestaudio/best[height<=720]/best",
     }
@@ -125,27 +256,128 @@ def download_and_collect_metadata(url: str) -> dict | None:
     # Equivalent to CLI: --remote-components ejs:github
     ydl_opts["remote_components"] = ["ejs:github"]
 
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        if not info:
-            return None
+    # yt-dlp records finished ids here and skips them before any network request.
+    ydl_opts["download_archive"] = str(ARCHIVE_FILE)
+    return ydl_opts
+
+
+_ydl_local = threading.local()
+_ydl_instances: list[YoutubeDL] = []
+_ydl_instances_lock = threading.Lock()
+
+
+def get_thread_ydl() -> YoutubeDL:
+    """Return this download thread's YoutubeDL, created on first use and reused after.
 
-        vid = info.get("id") or video_id_from_url(url)
-        channel = info.get("channel") or info.get("uploader") or ""
-        duration = info.get("duration")
-        title = info.get("title") or ""
-        description = (info.get("description") or "").strip()
+    One instance is not safe to share between threads, so each worker gets its own.
+    """
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is None:
+        ydl = YoutubeDL(build_ydl_opts())
+        _ydl_local.ydl = ydl
+        with _ydl_instances_lock:
+            _ydl_instances.append(ydl)
+    return ydl
 
-        return {
-            "id": vid,
-            "channel": channel,
-            "duration": duration,
-            "title": title,
-            "description": description,
-        }
 
+def close_thread_ydls() -> None:
+    """Close every YoutubeDL created by get_thread_ydl (saves cookies)."""
+    with _ydl_instances_lock:
+        instances = list(_ydl_instances)
+        _ydl_instances.clear()
+    for ydl in instances:
+        ydl.close()
 
-def run_consumer() -> None:
+
+def download_and_collect_metadata(ydl: YoutubeDL, url: str) -> dict | None:
+    """Download video to DOWNLOADS_DIR and return metadata dict for JSON."""
+    ensure_downloads_dir()
+    info = ydl.extract_info(url, download=True)
+    if not info:
+        return None
+
+    vid = info.get("id") or video_id_from_url(url)
+    channel = info.get("channel") or info.get("uploader") or ""
+    duration = info.get("duration")
+    title = info.get("title") or ""
+    description = (info.get("description") or "").strip()
+
+    return {
+        "id": vid,
+        "channel": channel,
+        "duration": duration,
+        "title": title,
+        "description": description,
+    }
+
+
+def already_downloaded(video_id: str | None) -> bool:
+    """True if {id}.mp4 is already in downloads/ or downloads_done/."""
+    if not video_id:
+        return False
+    name = f"{video_id}.mp4"
+    return (DOWNLOADS_DIR / name).exists() or (DONE_DIR / name).exists()
+
+
+def upload_worker(uploads: queue.Queue, base_url: str, tokens_by_username: dict[str, str]) -> None:
+    """Upload (video_path, meta) items from the queue until a None sentinel arrives.
+
+    A failed upload is logged to UPLOAD_ERROR_LOG and the file stays in downloads/
+    so a later push.py run can retry it.
+    """
+    while True:
+        item = uploads.get()
+        try:
+            if item is None:
+                return
+            video_path, meta = item
+            try:
+                push.upload_and_move(
+                    base_url, video_path, meta, tokens_by_username, DONE_DIR, UPLOAD_ERRORS_DIR
+                )
+            except Exception as e:
+                log_error(meta["id"], e, upload_error_logger)
+                print(f"  Upload failed (logged): {e}", file=sys.stderr)
+        finally:
+            uploads.task_done()
+
+
+def start_uploaders(base_url: str, workers: int) -> tuple[queue.Queue, list[threading.Thread]]:
+    """Start upload worker threads fed by a bounded queue of finished downloads."""
+    DONE_DIR.mkdir(parents=True, exist_ok=True)
+    UPLOAD_ERRORS_DIR.mkdir(parents=True, exist_ok=True)
+    uploads: queue.Queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+    tokens_by_username: dict[str, str] = {}
+    threads = [
+        threading.Thread(
+            target=upload_worker,
+            args=(uploads, base_url, tokens_by_username),
+            name=f"uploader-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for t in threads:
+        t.start()
+    return uploads, threads
+
+
+def stop_uploaders(uploads: queue.Queue, threads: list[threading.Thread]) -> None:
+    """Wait for queued uploads to finish, then stop the workers."""
+    print("Waiting for pending uploads...")
+    uploads.join()
+    for _ in threads:
+        uploads.put(None)
+    for t in threads:
+        t.join()
+
+
+def run_consumer(
+    upload_base_url: str | None = None,
+    upload_workers: int = push.DEFAULT_WORKERS,
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    urls_per_message: int = URLS_PER_MESSAGE,
+) -> None:
     credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
     parameters = pika.ConnectionParameters(
         host=RABBITMQ_HOST,
@@ -157,49 +389,103 @@ def run_consumer() -> None:
     conn = pika.BlockingConnection(parameters)
     channel = conn.channel()
     channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-    channel.basic_qos(prefetch_count=1)
-
-    timeout_occurred: list[bool] = [False]
-    rate_limit_occurred: list[bool] = [False]
-
-    def on_message(ch, method, properties, body):
-        url = body.decode("utf-8").strip()
-        video_id = video_id_from_url(url) or "unknown"
-        if not url:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-
+    download_workers = max(1, download_workers)
+    # prefetch counts messages, but a message is acked only after all of its URLs finish.
+    channel.basic_qos(prefetch_count=max(1, math.ceil(download_workers / max(1, urls_per_message))))
+
+    timeout_occurred = threading.Event()
+    rate_limit_occurred = threading.Event()
+    stopping = threading.Event()
+    rate_limiter = TokenBucket(DELAY_BETWEEN_DOWNLOADS_SEC)
+    downloads = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="download")
+
+    error_log_listener = start_error_logging()
+    uploads = threads = None
+    if upload_base_url:
+        uploads, threads = start_uploaders(upload_base_url, max(1, upload_workers))
+
+    # pika channels are not thread-safe: workers hand acks/nacks back to the
+    # connection thread via add_callback_threadsafe.
+    def ack(tag: int) -> None:
+        conn.add_callback_threadsafe(functools.partial(channel.basic_ack, delivery_tag=tag))
+
+    def nack(tag: int) -> None:
+        conn.add_callback_threadsafe(
+            functools.partial(channel.basic_nack, delivery_tag=tag, requeue=True)
+        )
+
+    def stop() -> None:
+        stopping.set()
+        conn.add_callback_threadsafe(channel.stop_consuming)
+
+    def process(url: str) -> bool:
+        """Handle one URL. False means it was not finished and its message must be requeued."""
+        video_id = video_id_from_url(url)
+        if already_downloaded(video_id):
+            print(f"Already downloaded, skipping: {url}")
+            return True
+        video_id = video_id or "unknown"
+        rate_limiter.acquire()
+        if stopping.is_set():
+            return False
         print(f"Processing: {url}")
         try:
-            meta = download_and_collect_metadata(url)
+            meta = download_and_collect_metadata(get_thread_ydl(), url)
             if meta:
-                records = load_metadata()
-                records.append(meta)
-                save_metadata(records)
+                append_metadata(meta)
                 title_preview = (meta.get("title") or "")[:50]
                 if len(meta.get("title") or "") > 50:
                     title_preview += "..."
                 print(f"  Saved metadata: id={meta.get('id')}, title={title_preview}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            time.sleep(DELAY_BETWEEN_DOWNLOADS_SEC)
+                video_path = DOWNLOADS_DIR / f"{meta['id']}.mp4"
+                if uploads is not None and video_path.exists():
+                    # Blocks while the uploaders are UPLOAD_QUEUE_SIZE files behind.
+                    uploads.put((video_path, meta))
+            return True
         except Exception as e:
             if is_timeout_error(e):
                 print(f"  Timeout: {e}", file=sys.stderr)
-                timeout_occurred[0] = True
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-                ch.stop_consuming()
-                return
+                timeout_occurred.set()
+                stop()
+                return False
             if is_rate_limit_error(e):
                 log_error(video_id, e)
                 print(f"  Rate limited: {e}", file=sys.stderr)
-                rate_limit_occurred[0] = True
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-                ch.stop_consuming()
-                return
+                rate_limit_occurred.set()
+                stop()
+                return False
             log_error(video_id, e)
             print(f"  Skipped (logged): {e}", file=sys.stderr)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            time.sleep(DELAY_BETWEEN_DOWNLOADS_SEC)
+            return True
+
+    def on_message(ch, method, properties, body):
+        urls = [u.strip() for u in body.decode("utf-8").splitlines() if u.strip()]
+        tag = method.delivery_tag
+        if not urls:
+            ch.basic_ack(delivery_tag=tag)
+            return
+        if stopping.is_set():
+            # Delivered while shutting down (e.g. during the final flush): hand it back.
+            ch.basic_nack(delivery_tag=tag, requeue=True)
+            return
+
+        state = {"remaining": len(urls), "requeue": False}
+        lock = threading.Lock()
+
+        def on_done(future) -> None:
+            finished = not future.cancelled() and future.exception() is None and future.result()
+            with lock:
+                state["requeue"] = state["requeue"] or not finished
+                state["remaining"] -= 1
+                if state["remaining"]:
+                    return
+            if state["requeue"]:
+                nack(tag)
+            else:
+                ack(tag)
+
+        for url in urls:
+            downloads.submit(process, url).add_done_callback(on_done)
 
     channel.basic_consume(
         queue=RABBITMQ_QUEUE,
@@ -209,17 +495,102 @@ def run_consumer() -> None:
 
     print(f"Consuming from queue '{RABBITMQ_QUEUE}'. Downloads: {DOWNLOADS_DIR}")
     print("Errors logged to:", ERROR_LOG)
+    if uploads is not None:
+        print(f"Uploading finished downloads to {upload_base_url}")
     print("Ctrl+C to stop.")
-    channel.start_consuming()
-
-    if timeout_occurred[0]:
+    try:
+        channel.start_consuming()
+    finally:
+        # Downloads not yet started are cancelled, which nacks (requeues) their messages.
+        stopping.set()
+        # Wait for in-flight downloads off the connection thread: BlockingConnection only
+        # sends heartbeats (and runs worker acks) inside process_data_events.
+        waiter = threading.Thread(
+            target=downloads.shutdown, kwargs={"wait": True, "cancel_futures": True}
+        )
+        waiter.start()
+        try:
+            while waiter.is_alive() and conn.is_open:
+                conn.process_data_events(time_limit=1)
+            waiter.join()
+            if conn.is_open:
+                conn.process_data_events(time_limit=0)  # flush acks/nacks from finished workers
+        except pika.exceptions.AMQPError as e:
+            print(
+                f"Connection lost while shutting down (unacked messages will be redelivered): {e}",
+                file=sys.stderr,
+            )
+        waiter.join()
+        close_thread_ydls()
+        if uploads is not None:
+            stop_uploaders(uploads, threads)
+        stop_error_logging(error_log_listener)
+        if conn.is_open:
+            try:
+                conn.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    if timeout_occurred.is_set():
         print("Exiting due to YouTube timeout.", file=sys.stderr)
         sys.exit(1)
-    if rate_limit_occurred[0]:
+    if rate_limit_occurred.is_set():
         print("Exiting due to rate limit.", file=sys.stderr)
         sys.exit(1)
 
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Download videos from the RabbitMQ queue")
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=DEFAULT_DOWNLOAD_WORKERS,
+        metavar="N",
+        help=f"Concurrent downloads (default: {DEFAULT_DOWNLOAD_WORKERS})",
+    )
+    parser.add_argument(
+        "--urls-per-message",
+        type=int,
+        default=URLS_PER_MESSAGE,
+        metavar="N",
+        help=f"URLs per message as published by a_q_put_videos.py; sizes prefetch (default: {URLS_PER_MESSAGE})",
+    )
+    parser.add_argument(
+        "--upload",
+        action="store_true",
+        help="Upload each finished download to HIFFI while the next one downloads",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=os.environ.get("HIFFI_BASE_URL", "https://api.hiffi.com"),
+        help="API base URL (with --upload)",
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=push.DEFAULT_WORKERS,
+        metavar="N",
+        help=f"Concurrent uploads (default: {push.DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help=f"Write {METADATA_JSON.name} from {METADATA_JSONL.name} and exit",
+    )
+    args = parser.parse_args()
+    if args.compact:
+        count = compact_to_json()
+        print(f"Wrote {count} records to {METADATA_JSON}")
+        return
+    run_consumer(
+        args.base_url if args.upload else None,
+        args.upload_workers,
+        args.workers,
+        args.urls_per_message,
+    )
+
+
 if __name__ == "__main__":
-    run_consumer()
+    main()
     sys.exit(0)